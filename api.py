@@ -1,62 +1,253 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 import os
+import time
+import msgspec
+import orjson
 from dotenv import load_dotenv
 from curriculum_agent import LlamaCurriculumAgent, CurriculumInput
 
 # Load environment variables
 load_dotenv()
+_API_KEY_SET = bool(os.getenv("GOOGLE_API_KEY"))
+
+# Request coalescing: POSTs already queued when the batcher wakes are
+# dispatched to the agent together; nothing waits for more to arrive
+MAX_BATCH = 16
+
+async def _dispatch_batch(agent: LlamaCurriculumAgent, items: List[Tuple[CurriculumInput, asyncio.Future]]):
+    """Run one batch through the agent and resolve the waiting futures"""
+    # Identical (target_language, scenario) requests share a single generation
+    groups: Dict[Tuple[str, str, bool], List[asyncio.Future]] = {}
+    inputs: List[CurriculumInput] = []
+    for curriculum_input, future in items:
+        key = (curriculum_input.target_language, curriculum_input.scenario, curriculum_input.cache)
+        if key not in groups:
+            groups[key] = []
+            inputs.append(curriculum_input)
+        groups[key].append(future)
+
+    try:
+        results = await agent.generate_curriculum_batch(inputs)
+    except Exception as e:
+        for futures in groups.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        return
+
+    # Each group gets its own outcome; one failed input leaves the others untouched
+    for futures, result in zip(groups.values(), results):
+        for future in futures:
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+async def _batcher(agent: LlamaCurriculumAgent, pending: asyncio.Queue, batch_tasks: set):
+    """Collect queued requests into batches of up to MAX_BATCH items"""
+    while True:
+        items = [await pending.get()]
+        # Drain what is ready right now; a lone request is dispatched immediately
+        while len(items) < MAX_BATCH and not pending.empty():
+            items.append(pending.get_nowait())
+
+        # Dispatch without waiting so the next batch can fill while this one runs
+        task = asyncio.create_task(_dispatch_batch(agent, items))
+        batch_tasks.add(task)
+        task.add_done_callback(batch_tasks.discard)
+
+# CORS headers for the allow-everything policy, built once. Credentials are
+# allowed, so the request's Origin is echoed back rather than sending "*".
+# In production, restrict this to your frontend domain.
+_CORS_HEADERS = [
+    (b"access-control-allow-credentials", b"true"),
+    (b"vary", b"Origin"),
+]
+_PREFLIGHT_HEADERS = [
+    (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+    (b"access-control-max-age", b"600"),
+]
+
+class FastCORSMiddleware:
+    """ASGI middleware appending precomputed CORS headers, without per-request policy matching"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        # Not a cross-origin request
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        cors_headers = [(b"access-control-allow-origin", origin), *_CORS_HEADERS]
+
+        # Answer preflights directly; every method and header is allowed
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = cors_headers + _PREFLIGHT_HEADERS
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the curriculum agent once per worker and run the batcher"""
+    try:
+        # Pre-computes on this worker's loop, which later requests reuse
+        app.state.agent = await LlamaCurriculumAgent.create()
+    except Exception as e:
+        print(f"Warning: Could not initialize curriculum agent: {e}")
+        app.state.agent = None
+
+    # Serialized /available-scenarios payload, built on first request
+    app.state.scenarios_cache = None
+    # (expires_at, body) of the last /health payload
+    app.state.health_cache = None
+
+    # Batcher queue, dispatched batches and in-flight generations all belong to
+    # this lifespan's event loop, so they live on app.state rather than the module
+    app.state.pending = asyncio.Queue()
+    app.state.batch_tasks = set()
+    app.state.inflight = {}
+    tasks = []
+    if app.state.agent is not None:
+        tasks.append(asyncio.create_task(_batcher(app.state.agent, app.state.pending, app.state.batch_tasks)))
+    yield
+
+    # Cancel everything still running so no task or future outlives this loop
+    tasks.extend(app.state.batch_tasks)
+    tasks.extend(app.state.inflight.values())
+    while not app.state.pending.empty():
+        _, future = app.state.pending.get_nowait()
+        future.cancel()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    app.state.inflight.clear()
+    if app.state.agent is not None:
+        await app.state.agent.aclose()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Language Learning Curriculum API",
     description="API for generating language learning curriculum content",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your frontend domain
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(FastCORSMiddleware)
 
-# Initialize the curriculum agent
-try:
-    agent = LlamaCurriculumAgent()
-except Exception as e:
-    print(f"Warning: Could not initialize curriculum agent: {e}")
-    agent = None
+def get_agent(request: Request) -> Optional[LlamaCurriculumAgent]:
+    """Return this worker's curriculum agent, or None if it failed to initialize"""
+    return request.app.state.agent
 
-# Pydantic models for API requests and responses
-class CurriculumRequest(BaseModel):
+def get_pending_queue(request: Request) -> asyncio.Queue:
+    """Return this worker's batcher input queue of (CurriculumInput, Future) pairs"""
+    return request.app.state.pending
+
+def get_inflight(request: Request) -> Dict[Tuple[str, str, bool], "asyncio.Task[bytes]"]:
+    """Return this worker's running generations, so concurrent identical requests share one"""
+    return request.app.state.inflight
+
+# msgspec structs for the curriculum request/response path; each type gets its
+# own compiled decoder/encoder instead of going through pydantic
+class CurriculumRequest(msgspec.Struct):
     target_language: str
     scenario: str
+    # False skips the response and curriculum caches and forces a fresh generation
+    cache: bool = True
 
-class CurriculumQuestion(BaseModel):
+class CurriculumQuestion(msgspec.Struct):
     question: str
     expected_response: str
 
-class CorrectionExample(BaseModel):
+class CorrectionExample(msgspec.Struct):
     incorrect_phrase: str
     correct_phrase: str
     explanation: str
 
-class CurriculumResponse(BaseModel):
+class CurriculumResponse(msgspec.Struct):
     scenario_scene: str
     curriculum_questions: List[CurriculumQuestion]
     correction_examples: List[CorrectionExample]
 
+_request_decoder = msgspec.json.Decoder(CurriculumRequest)
+_response_encoder = msgspec.json.Encoder()
+
+# OpenAPI schemas for the structs, since FastAPI only documents pydantic models
+(_REQUEST_SCHEMA, _RESPONSE_SCHEMA), _STRUCT_SCHEMAS = msgspec.json.schema_components(
+    (CurriculumRequest, CurriculumResponse),
+    ref_template="#/components/schemas/{name}"
+)
+
+async def decode_curriculum_request(request: Request) -> CurriculumRequest:
+    """Decode and validate the request body with msgspec"""
+    try:
+        return _request_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def _openapi_with_structs() -> dict:
+    """Generate the OpenAPI spec, adding the msgspec struct schemas to its components"""
+    if app.openapi_schema is None:
+        schema = _default_openapi()
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_STRUCT_SCHEMAS)
+    return app.openapi_schema
+
+_default_openapi = app.openapi
+app.openapi = _openapi_with_structs
+
+# Pydantic models for the health and stats responses
 class HealthResponse(BaseModel):
     status: str
     message: str
     agent_available: bool
     cache_stats: dict = {}
 
+# Health payloads are served pre-serialized; the agent-unavailable one never changes
+HEALTH_CACHE_TTL_SECONDS = 5
+_UNAVAILABLE_HEALTH = orjson.dumps(HealthResponse(
+    status="healthy",
+    message="Language Learning Curriculum API is running",
+    agent_available=False,
+    cache_stats={}
+).model_dump())
+
 class AvailableScenariosResponse(BaseModel):
     scenarios: List[str]
     languages: List[str]
@@ -67,30 +258,102 @@ class CacheStatsResponse(BaseModel):
     cached_combinations: List[str]
     cache_hit_rate: str
 
-@app.get("/", response_model=HealthResponse)
-async def root():
-    """Health check endpoint"""
-    cache_stats = agent.get_cache_stats() if agent else {}
-    return HealthResponse(
-        status="healthy",
-        message="Language Learning Curriculum API is running",
-        agent_available=agent is not None,
-        cache_stats=cache_stats
-    )
+# Response cache for repeated (target_language, scenario) requests
+CACHE_MAX_ENTRIES = 512
+CACHE_TTL_SECONDS = 300
+
+class ResponseCache:
+    """Bounded LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Tuple[str, str], value: bytes):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+_response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
+async def _generate_response(pending: asyncio.Queue, curriculum_input: CurriculumInput, key: Tuple[str, str]) -> bytes:
+    """Queue an input for the batcher, then encode the result once and cache the bytes"""
+    future = asyncio.get_running_loop().create_future()
+    await pending.put((curriculum_input, future))
+    curriculum = await future
 
+    # Convert the agent's dicts to structs in a single msgspec pass
+    response = msgspec.convert({
+        "scenario_scene": curriculum.scenario_scene,
+        "curriculum_questions": curriculum.curriculum_questions,
+        "correction_examples": curriculum.correction_examples
+    }, CurriculumResponse)
+    body = _response_encoder.encode(response)
+    # A fallback stands in for a transient Gemini failure; let the next request retry
+    if not curriculum.is_fallback:
+        _response_cache.set(key, body)
+    return body
+
+# "/" serves the same handler but stays out of the OpenAPI schema
+@app.get("/", response_model=HealthResponse, include_in_schema=False)
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(
+    request: Request,
+    agent: Optional[LlamaCurriculumAgent] = Depends(get_agent)
+):
     """Health check endpoint"""
-    cache_stats = agent.get_cache_stats() if agent else {}
-    return HealthResponse(
-        status="healthy",
-        message="Language Learning Curriculum API is running",
-        agent_available=agent is not None,
-        cache_stats=cache_stats
-    )
+    if agent is None:
+        return Response(content=_UNAVAILABLE_HEALTH, media_type="application/json")
+    
+    # Cache stats change slowly, so reuse the serialized payload for a few seconds
+    health_cache = request.app.state.health_cache
+    if health_cache is None or health_cache[0] < time.monotonic():
+        # In-memory and cheap; runs on the loop so the caches are never iterated while being written
+        cache_stats = agent.get_cache_stats()
+        body = orjson.dumps(HealthResponse(
+            status="healthy",
+            message="Language Learning Curriculum API is running",
+            agent_available=True,
+            cache_stats=cache_stats
+        ).model_dump())
+        health_cache = (time.monotonic() + HEALTH_CACHE_TTL_SECONDS, body)
+        request.app.state.health_cache = health_cache
+    
+    return Response(content=health_cache[1], media_type="application/json")
+
+def _etag(body: bytes) -> str:
+    """Strong ETag derived from the serialized response body"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def _etag_response(request: Request, etag: str, body: bytes, cache_control: str) -> Response:
+    """Serve pre-serialized JSON with an ETag, or an empty 304 if the client already has it"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/available-scenarios", response_model=AvailableScenariosResponse)
-async def get_available_scenarios():
+async def get_available_scenarios(
+    request: Request,
+    agent: Optional[LlamaCurriculumAgent] = Depends(get_agent)
+):
     """Get available scenarios and languages from the knowledge base"""
     if agent is None:
         raise HTTPException(
@@ -98,23 +361,31 @@ async def get_available_scenarios():
             detail="Curriculum agent is not available. Please check your API key and try again."
         )
     
-    try:
-        # Get scenarios and languages from the agent's knowledge base
-        scenarios, languages = agent.get_available_scenarios_and_languages()
-        
-        return AvailableScenariosResponse(
-            scenarios=scenarios,
-            languages=languages
-        )
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving available scenarios and languages: {str(e)}"
-        )
+    if request.app.state.scenarios_cache is None:
+        try:
+            # Get scenarios and languages from the agent's knowledge base
+            scenarios, languages = agent.get_available_scenarios_and_languages()
+            
+            body = orjson.dumps(AvailableScenariosResponse(
+                scenarios=scenarios,
+                languages=languages
+            ).model_dump())
+            request.app.state.scenarios_cache = (_etag(body), body)
+            
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error retrieving available scenarios and languages: {str(e)}"
+            )
+    
+    etag, body = request.app.state.scenarios_cache
+    return _etag_response(request, etag, body, "public, max-age=300")
 
 @app.get("/cache-stats", response_model=CacheStatsResponse)
-async def get_cache_stats():
+async def get_cache_stats(
+    request: Request,
+    agent: Optional[LlamaCurriculumAgent] = Depends(get_agent)
+):
     """Get cache statistics"""
     if agent is None:
         raise HTTPException(
@@ -122,10 +393,22 @@ async def get_cache_stats():
             detail="Curriculum agent is not available."
         )
     
-    return CacheStatsResponse(**agent.get_cache_stats())
+    # Stats can change, so clients must revalidate; unchanged stats still get a bodiless 304
+    cache_stats = agent.get_cache_stats()
+    body = orjson.dumps(CacheStatsResponse(**cache_stats).model_dump())
+    return _etag_response(request, _etag(body), body, "no-cache")
 
-@app.post("/generate-curriculum", response_model=CurriculumResponse)
-async def generate_curriculum(request: CurriculumRequest):
+@app.post(
+    "/generate-curriculum",
+    responses={200: {"content": {"application/json": {"schema": _RESPONSE_SCHEMA}}}},
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": _REQUEST_SCHEMA}}}}
+)
+async def generate_curriculum(
+    request: CurriculumRequest = Depends(decode_curriculum_request),
+    agent: Optional[LlamaCurriculumAgent] = Depends(get_agent),
+    pending: asyncio.Queue = Depends(get_pending_queue),
+    inflight: Dict[Tuple[str, str, bool], "asyncio.Task[bytes]"] = Depends(get_inflight)
+):
     """Generate curriculum content for a specific language and scenario"""
     
     if agent is None:
@@ -141,33 +424,31 @@ async def generate_curriculum(request: CurriculumRequest):
             detail="Both target_language and scenario are required"
         )
     
+    key = (request.target_language.casefold(), request.scenario.casefold())
+    if request.cache:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            # Pre-encoded bytes: no validation or serialization on a hit
+            return Response(content=cached, media_type="application/json")
+    
     try:
-        # Create curriculum input
-        curriculum_input = CurriculumInput(
-            target_language=request.target_language,
-            scenario=request.scenario
-        )
+        # Uncached requests only share a generation with other uncached requests
+        inflight_key = key + (request.cache,)
+        task = inflight.get(inflight_key)
+        if task is None:
+            # Create curriculum input
+            curriculum_input = CurriculumInput(
+                target_language=request.target_language,
+                scenario=request.scenario,
+                cache=request.cache
+            )
+            task = asyncio.create_task(_generate_response(pending, curriculum_input, key))
+            inflight[inflight_key] = task
+            task.add_done_callback(lambda _: inflight.pop(inflight_key, None))
         
-        # Generate curriculum
-        curriculum = agent.generate_curriculum(curriculum_input)
-        
-        # Convert to response format
-        return CurriculumResponse(
-            scenario_scene=curriculum.scenario_scene,
-            curriculum_questions=[
-                CurriculumQuestion(
-                    question=q["question"],
-                    expected_response=q["expected_response"]
-                ) for q in curriculum.curriculum_questions
-            ],
-            correction_examples=[
-                CorrectionExample(
-                    incorrect_phrase=c["incorrect_phrase"],
-                    correct_phrase=c["correct_phrase"],
-                    explanation=c["explanation"]
-                ) for c in curriculum.correction_examples
-            ]
-        )
+        # Shield the shared task so one client disconnecting doesn't cancel it for the others
+        body = await asyncio.shield(task)
+        return Response(content=body, media_type="application/json")
         
     except Exception as e:
         raise HTTPException(
@@ -175,15 +456,59 @@ async def generate_curriculum(request: CurriculumRequest):
             detail=f"Error generating curriculum: {str(e)}"
         )
 
+@app.post(
+    "/generate-curriculum/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": _REQUEST_SCHEMA}}}}
+)
+async def generate_curriculum_stream(
+    request: CurriculumRequest = Depends(decode_curriculum_request),
+    agent: Optional[LlamaCurriculumAgent] = Depends(get_agent)
+):
+    """Stream the curriculum completion as NDJSON {"delta": ...} lines as the LLM emits it"""
+    
+    if agent is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="Curriculum agent is not available. Please check your API key and try again."
+        )
+    
+    # Validate input
+    if not request.target_language or not request.scenario:
+        raise HTTPException(
+            status_code=400,
+            detail="Both target_language and scenario are required"
+        )
+    
+    curriculum_input = CurriculumInput(
+        target_language=request.target_language,
+        scenario=request.scenario
+    )
+    
+    async def stream_chunks():
+        try:
+            async for chunk in agent.generate_curriculum_stream(curriculum_input):
+                yield orjson.dumps({"delta": chunk}) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield orjson.dumps({"error": f"Error generating curriculum: {str(e)}"}) + b"\n"
+    
+    return StreamingResponse(stream_chunks(), media_type="application/x-ndjson")
+
 @app.get("/test")
-async def test_endpoint():
+async def test_endpoint(agent: Optional[LlamaCurriculumAgent] = Depends(get_agent)):
     """Test endpoint to verify API is working"""
     return {
         "message": "API is working!",
         "agent_available": agent is not None,
-        "api_key_set": bool(os.getenv("GOOGLE_API_KEY"))
+        "api_key_set": _API_KEY_SET
     }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # One process per CPU by default; override with WEB_CONCURRENCY.
+    # uvicorn[standard] installs uvloop and httptools, which the default
+    # "auto" loop/http settings pick up.
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run("api:app", host="0.0.0.0", port=8000, workers=workers)
@@ -0,0 +1,77 @@
+"""Upstream invariants that /generate-curriculum relies on when it skips re-validating the agent's output."""
+import asyncio
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from curriculum_agent import CurriculumInput, LlamaCurriculumAgent
+
+VALID_REPLY = {
+    "scenario_scene": "You walk into a small cafe in Paris.",
+    "curriculum_questions": [
+        {"question": "How do you order a coffee?", "expected_response": "Je voudrais un café, s'il vous plaît."}
+    ],
+    "correction_examples": [
+        {"incorrect_phrase": "Je veux café", "correct_phrase": "Je voudrais un café", "explanation": "Use the conditional."}
+    ],
+}
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeGemini:
+    def __init__(self, text):
+        self._text = text
+
+    async def generate_content_async(self, prompt):
+        return _FakeResponse(self._text)
+
+
+@pytest.fixture
+def agent():
+    # Skip __init__: these tests only exercise parsing, not the index or the network
+    agent = object.__new__(LlamaCurriculumAgent)
+
+    async def get_contexts(input_data):
+        return "knowledge", "real world"
+    agent._get_contexts = get_contexts
+    return agent
+
+
+def test_valid_reply_passes_through_unchanged(agent):
+    curriculum = agent._parse_curriculum_response(json.dumps(VALID_REPLY))
+    assert curriculum.model_dump(exclude={"is_fallback"}) == VALID_REPLY
+    assert not curriculum.is_fallback
+
+
+def test_fenced_reply_is_extracted(agent):
+    reply = "Here you go:\n```json\n" + json.dumps(VALID_REPLY) + "\n```"
+    assert agent._parse_curriculum_response(reply).model_dump(exclude={"is_fallback"}) == VALID_REPLY
+
+
+def test_extra_keys_are_dropped(agent):
+    reply = json.loads(json.dumps(VALID_REPLY))
+    reply["difficulty"] = "A2"
+    reply["curriculum_questions"][0]["hint"] = "Be polite"
+    curriculum = agent._parse_curriculum_response(json.dumps(reply))
+    assert curriculum.model_dump(exclude={"is_fallback"}) == VALID_REPLY
+
+
+def test_missing_key_is_rejected(agent):
+    reply = json.loads(json.dumps(VALID_REPLY))
+    del reply["curriculum_questions"][0]["expected_response"]
+    with pytest.raises(ValidationError):
+        agent._parse_curriculum_response(json.dumps(reply))
+
+
+def test_missing_key_falls_back(agent):
+    reply = {key: value for key, value in VALID_REPLY.items() if key != "correction_examples"}
+    agent._gemini = _FakeGemini(json.dumps(reply))
+    input_data = CurriculumInput(target_language="French", scenario="Cafe Order", cache=False)
+    curriculum = asyncio.run(agent.generate_curriculum_async(input_data))
+    assert curriculum.is_fallback
+    assert curriculum.curriculum_questions and curriculum.correction_examples